@@ -1,11 +1,27 @@
 # ask.py — AI SQL Agent using OpenAI GPT-4o-mini + SQLite + .env
 
-import json
+import asyncio
+import hashlib
 import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+import numpy as np
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from openai import OpenAI
-from sqlalchemy import create_engine, text
+from openai import AsyncOpenAI
+from sqlalchemy import MetaData, create_engine, event, text
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.schema import CreateTable
 from schemas import AskRequest, AskResponse
 
 # 1️⃣ Load .env file
@@ -16,54 +32,594 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("❌ OPENAI_API_KEY not found in .env file")
 
-client = OpenAI(api_key=api_key)
+# One long-lived HTTP/2 connection pool shared by every request, with explicit timeouts
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+)
+client = AsyncOpenAI(api_key=api_key, http_client=http_client)
+
+# 3️⃣ Connect to SQLite database — pooled, so connections (and their page cache) stay warm
+DB_PATH = "Chinook_Sqlite.sqlite"
+engine = create_async_engine(
+    f"sqlite+aiosqlite:///{DB_PATH}",
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=8,
+    max_overflow=4,
+    pool_pre_ping=True,
+)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _):
+    # Read-only workload: tune the read path only. journal_mode / synchronous are
+    # left alone so running the app never rewrites the checked-in database file.
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA cache_size=-65536")      # 64 MB page cache per connection
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")    # 256 MB
+    cursor.close()
 
-# 3️⃣ Connect to SQLite database
-engine = create_engine("sqlite:///Chinook_Sqlite.sqlite")
 
-# 4️⃣ Function to handle user query
-def ask_database(question: str) -> AskResponse:
+def dump_schema() -> dict:
+    """Return ``{table_name: CREATE TABLE DDL}`` for every table, reflected once at import.
+
+    Uses a throwaway sync engine: import time has no event loop to drive the async one.
+    """
+    sync_engine = create_engine(f"sqlite:///{DB_PATH}")
     try:
-        # Step 1: Let GPT-4o-mini generate SQL
-        prompt = f"""
-        You are an expert SQL generator for the SQLite 'Chinook' database.
-        Tables include: Artist, Album, Track, Customer, Invoice, and Genre.
-        Convert the following user question into a valid SQL SELECT query.
-        Return ONLY SQL code, no explanations or markdown.
-        Question: {question}
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful SQL assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0
+        metadata = MetaData()
+        metadata.reflect(bind=sync_engine)
+        return {
+            name: str(CreateTable(table).compile(sync_engine)).strip()
+            for name, table in sorted(metadata.tables.items())
+        }
+    finally:
+        sync_engine.dispose()
+
+
+TABLE_DDL = dump_schema()
+
+
+
+# Everything that does not depend on the selected tables, so every request shares it as a
+# prompt prefix. OpenAI only caches prompts from 1024 tokens on, matched from the start,
+# so this must stay above that on its own: ~5.8k characters, i.e. ~1.3-1.7k tokens at
+# 3.5-4.5 characters per token.
+SQL_PROMPT_PREFIX = """You are an expert SQL generator for the SQLite 'Chinook' database (a digital music store).
+Convert the user's question into a single valid SQLite SELECT query.
+Put the SQL in the "sql" field of the JSON response, with no explanations or markdown.
+Use only the tables and columns defined in the Schema section at the end. Alias aggregate columns with readable names.
+Ignore chart hints such as "(bar chart)" or "(line chart)" in the question.
+
+SQLite rules:
+- Dates are stored as text; use strftime('%Y', col) for years and strftime('%Y-%m', col) for months.
+- Concatenate with ||, e.g. FirstName || ' ' || LastName.
+- LIKE is case-insensitive for ASCII text; there is no ILIKE.
+- Round money with ROUND(x, 2). Sales per line are UnitPrice * Quantity; Invoice.Total is the invoice amount.
+- Track lengths are in Milliseconds; divide by 60000.0 for minutes.
+- Use LIMIT for "top N" questions, ORDER BY for rankings and trends, and GROUP BY the key, not only the name.
+- Prefer explicit JOIN ... ON over comma joins; use LEFT JOIN when rows without a match must be kept.
+- Filter on aggregates with HAVING; answer "never" / "without" questions with NOT EXISTS.
+- "Sales", "revenue" and "spend" mean money (Invoice.Total or UnitPrice * Quantity); "units sold" means SUM(Quantity).
+
+Relationships:
+- Album.ArtistId -> Artist.ArtistId
+- Track.AlbumId -> Album.AlbumId; Track.GenreId -> Genre.GenreId; Track.MediaTypeId -> MediaType.MediaTypeId
+- InvoiceLine.InvoiceId -> Invoice.InvoiceId; InvoiceLine.TrackId -> Track.TrackId
+- Invoice.CustomerId -> Customer.CustomerId
+- Customer.SupportRepId -> Employee.EmployeeId; Employee.ReportsTo -> Employee.EmployeeId
+- PlaylistTrack.PlaylistId -> Playlist.PlaylistId; PlaylistTrack.TrackId -> Track.TrackId
+
+Examples:
+Question: Top 5 artists by number of albums
+SQL: SELECT ar.Name AS Artist, COUNT(al.AlbumId) AS Albums FROM Artist ar JOIN Album al ON al.ArtistId = ar.ArtistId GROUP BY ar.ArtistId ORDER BY Albums DESC LIMIT 5
+
+Question: Total invoice amount by country
+SQL: SELECT BillingCountry AS Country, ROUND(SUM(Total), 2) AS TotalSales FROM Invoice GROUP BY BillingCountry ORDER BY TotalSales DESC
+
+Question: Monthly sales trend for 2010-2013
+SQL: SELECT strftime('%Y-%m', InvoiceDate) AS Month, ROUND(SUM(Total), 2) AS Sales FROM Invoice WHERE strftime('%Y', InvoiceDate) BETWEEN '2010' AND '2013' GROUP BY Month ORDER BY Month
+
+Question: Tracks per genre
+SQL: SELECT g.Name AS Genre, COUNT(t.TrackId) AS Tracks FROM Genre g JOIN Track t ON t.GenreId = g.GenreId GROUP BY g.GenreId ORDER BY Tracks DESC
+
+Question: Revenue by genre
+SQL: SELECT g.Name AS Genre, ROUND(SUM(il.UnitPrice * il.Quantity), 2) AS Revenue FROM InvoiceLine il JOIN Track t ON t.TrackId = il.TrackId JOIN Genre g ON g.GenreId = t.GenreId GROUP BY g.GenreId ORDER BY Revenue DESC
+
+Question: Top 10 customers by total spend
+SQL: SELECT c.FirstName || ' ' || c.LastName AS Customer, c.Country, ROUND(SUM(i.Total), 2) AS TotalSpent FROM Customer c JOIN Invoice i ON i.CustomerId = c.CustomerId GROUP BY c.CustomerId ORDER BY TotalSpent DESC LIMIT 10
+
+Question: Sales handled by each support rep
+SQL: SELECT e.FirstName || ' ' || e.LastName AS SalesRep, ROUND(SUM(i.Total), 2) AS Sales FROM Employee e JOIN Customer c ON c.SupportRepId = e.EmployeeId JOIN Invoice i ON i.CustomerId = c.CustomerId GROUP BY e.EmployeeId ORDER BY Sales DESC
+
+Question: Average track length in minutes by media type
+SQL: SELECT m.Name AS MediaType, ROUND(AVG(t.Milliseconds) / 60000.0, 2) AS AvgMinutes FROM MediaType m JOIN Track t ON t.MediaTypeId = m.MediaTypeId GROUP BY m.MediaTypeId ORDER BY AvgMinutes DESC
+
+Question: Number of tracks in each playlist
+SQL: SELECT p.Name AS Playlist, COUNT(pt.TrackId) AS Tracks FROM Playlist p JOIN PlaylistTrack pt ON pt.PlaylistId = p.PlaylistId GROUP BY p.PlaylistId ORDER BY Tracks DESC
+
+Question: 10 best-selling tracks
+SQL: SELECT t.Name AS Track, ar.Name AS Artist, SUM(il.Quantity) AS UnitsSold FROM InvoiceLine il JOIN Track t ON t.TrackId = il.TrackId JOIN Album al ON al.AlbumId = t.AlbumId JOIN Artist ar ON ar.ArtistId = al.ArtistId GROUP BY t.TrackId ORDER BY UnitsSold DESC LIMIT 10
+
+Question: Revenue per year
+SQL: SELECT strftime('%Y', InvoiceDate) AS Year, ROUND(SUM(Total), 2) AS Revenue FROM Invoice GROUP BY Year ORDER BY Year
+
+Question: Employees and their managers
+SQL: SELECT e.FirstName || ' ' || e.LastName AS Employee, e.Title, m.FirstName || ' ' || m.LastName AS Manager FROM Employee e LEFT JOIN Employee m ON m.EmployeeId = e.ReportsTo ORDER BY Manager
+
+Question: Customers per country
+SQL: SELECT Country, COUNT(*) AS Customers FROM Customer GROUP BY Country ORDER BY Customers DESC
+
+Question: Tracks by AC/DC
+SQL: SELECT t.Name AS Track, al.Title AS Album FROM Track t JOIN Album al ON al.AlbumId = t.AlbumId JOIN Artist ar ON ar.ArtistId = al.ArtistId WHERE ar.Name = 'AC/DC' ORDER BY al.Title, t.TrackId
+
+Question: Share of revenue by country
+SQL: SELECT BillingCountry AS Country, ROUND(SUM(Total), 2) AS Revenue, ROUND(100.0 * SUM(Total) / SUM(SUM(Total)) OVER (), 1) AS SharePct FROM Invoice GROUP BY BillingCountry ORDER BY Revenue DESC
+
+Question: Albums with more than 20 tracks
+SQL: SELECT al.Title AS Album, COUNT(t.TrackId) AS Tracks FROM Album al JOIN Track t ON t.AlbumId = al.AlbumId GROUP BY al.AlbumId HAVING COUNT(t.TrackId) > 20 ORDER BY Tracks DESC
+
+Question: Average invoice total by customer country
+SQL: SELECT c.Country, ROUND(AVG(i.Total), 2) AS AvgInvoice FROM Customer c JOIN Invoice i ON i.CustomerId = c.CustomerId GROUP BY c.Country ORDER BY AvgInvoice DESC
+
+Question: Artists who have never sold a track
+SQL: SELECT ar.Name AS Artist FROM Artist ar WHERE NOT EXISTS (SELECT 1 FROM Album al JOIN Track t ON t.AlbumId = al.AlbumId JOIN InvoiceLine il ON il.TrackId = t.TrackId WHERE al.ArtistId = ar.ArtistId) ORDER BY ar.Name
+"""
+
+
+@lru_cache(maxsize=None)
+def build_system_prompt(tables: Tuple[str, ...]) -> str:
+    """System prompt for a set of tables: the shared SQL_PROMPT_PREFIX, then their DDL.
+
+    ``tables`` must be sorted so each table set maps to one byte-identical prompt. The
+    selected DDL goes last so requests with different tables still share the whole prefix
+    in OpenAI's automatic prompt cache. Never interpolate the question or anything
+    per-request into this string; the question goes in the user message.
+    """
+    schema = "\n".join(TABLE_DDL[name] for name in tables)
+    return f"{SQL_PROMPT_PREFIX}\nSchema:\n{schema}\n"
+
+ALL_TABLES = tuple(TABLE_DDL)
+
+# 4️⃣ Semantic cache — skip the LLM round-trip for repeat / near-duplicate questions
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIM = 1536
+CACHE_PATH = os.getenv("QA_CACHE_PATH", "qa_cache.sqlite")
+CACHE_TTL_HOURS = float(os.getenv("QA_CACHE_TTL_HOURS", "24"))
+CACHE_MAX_ENTRIES = int(os.getenv("QA_CACHE_MAX_ENTRIES", "1000"))  # each holds up to ROW_LIMIT rows
+SQL_REUSE_THRESHOLD = 0.93     # above this, reuse the cached SQL
+RESULT_REUSE_THRESHOLD = 0.98  # above this, reuse the cached result as well
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+
+async def embed(question: str) -> np.ndarray:
+    response = await client.embeddings.create(model=EMBED_MODEL, input=normalize_question(question))
+    vec = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vec / (np.linalg.norm(vec) or 1.0)
+
+
+# Column-split query result: {"columns": [...], "data": [[...], ...]}
+ResultPayload = Dict[str, list]
+
+
+def _load_result(result: Optional[str]) -> Optional[ResultPayload]:
+    """Decode a persisted result; unreadable ones (e.g. older formats) only reuse the SQL."""
+    try:
+        return orjson.loads(result) if result else None
+    except orjson.JSONDecodeError:
+        return None
+
+
+@dataclass
+class CacheHit:
+    similarity: float
+    sql: str
+    result: Optional[ResultPayload]
+
+
+class SemanticCache:
+    """In-memory (N, EMBED_DIM) matrix of question embeddings, persisted to a sidecar
+    SQLite table so it survives restarts. Entries older than ``ttl_hours`` are ignored
+    on lookup and purged on load and on insert; beyond ``max_entries`` the oldest go."""
+
+    def __init__(self, path: str, ttl_hours: float, max_entries: int):
+        self.ttl = ttl_hours * 3600
+        self.max_entries = max_entries
+        self._lock = threading.Lock()     # in-memory index; taken on the event loop
+        self._db_lock = threading.Lock()  # sidecar DB writes; only held off the loop
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS qa_cache ("
+            "qhash TEXT PRIMARY KEY, embedding BLOB, sql TEXT, result TEXT, ts REAL)"
         )
+        self._db.execute("DELETE FROM qa_cache WHERE ts < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM qa_cache WHERE qhash NOT IN "
+            "(SELECT qhash FROM qa_cache ORDER BY ts DESC LIMIT ?)", (max_entries,)
+        )
+        self._db.commit()
 
-        sql_query = response.choices[0].message.content.strip()
-        print(f"🧠 GPT Generated SQL:\n{sql_query}\n")
+        rows = self._db.execute("SELECT qhash, embedding, sql, result, ts FROM qa_cache").fetchall()
+        self._index = {qhash: i for i, (qhash, *_) in enumerate(rows)}
+        self._entries = [(sql, _load_result(result), ts) for _, _, sql, result, ts in rows]
+        # Preallocated and grown by doubling, so an insert doesn't copy the whole matrix;
+        # only the first len(self._entries) rows are live.
+        self._matrix = np.empty((max(len(rows), 16), EMBED_DIM), dtype=np.float32)
+        for i, (_, blob, *_) in enumerate(rows):
+            self._matrix[i] = np.frombuffer(blob, dtype=np.float32)
+        self._oldest_ts = min((ts for *_, ts in self._entries), default=time.time())
 
-        # Step 2: Safety check — only SELECT queries allowed
-        if not sql_query.upper().startswith("SELECT"):
-            return AskResponse(answer="❌ Only SELECT queries are allowed.")
+    def _fresh(self, ts: float) -> bool:
+        return time.time() - ts <= self.ttl
+
+    def _evict(self, now: float) -> List[str]:
+        """Drop expired entries, then the oldest until one more fits; caller holds _lock.
+        Returns the evicted question hashes."""
+        by_age = sorted(self._index.items(), key=lambda item: self._entries[item[1]][2])
+        keep = [(qhash, i) for qhash, i in by_age if now - self._entries[i][2] <= self.ttl]
+        keep = keep[max(0, len(keep) - (self.max_entries - 1)):]
+        evicted = [qhash for qhash, _ in by_age[:len(by_age) - len(keep)]]  # expired ones are oldest
+        if evicted:
+            rows = [i for _, i in keep]
+            self._matrix[:len(rows)] = self._matrix[rows]
+            self._entries = [self._entries[i] for i in rows]
+            self._index = {qhash: j for j, (qhash, _) in enumerate(keep)}
+        self._oldest_ts = min((ts for *_, ts in self._entries), default=now)
+        return evicted
+
+    def get(self, qhash: str) -> Optional[CacheHit]:
+        """Exact lookup on the normalized question — no embedding needed."""
+        with self._lock:
+            i = self._index.get(qhash)
+            if i is None:
+                return None
+            sql, result, ts = self._entries[i]
+        return CacheHit(1.0, sql, result) if self._fresh(ts) else None
+
+    def nearest(self, embedding: np.ndarray) -> Optional[CacheHit]:
+        with self._lock:
+            n = len(self._entries)
+            if not n:
+                return None
+            sims = self._matrix[:n] @ embedding
+            ts = np.fromiter((e[2] for e in self._entries), dtype=np.float64, count=n)
+            sims[ts < time.time() - self.ttl] = -1.0
+            i = int(np.argmax(sims))
+            sql, result, _ = self._entries[i]
+        return CacheHit(float(sims[i]), sql, result)
+
+    def put(self, qhash: str, embedding: np.ndarray, sql: str, result: ResultPayload) -> None:
+        ts = time.time()
+        vec = embedding.astype(np.float32)
+        evicted: List[str] = []
+        with self._lock:
+            i = self._index.get(qhash)
+            if i is None:
+                if len(self._entries) >= self.max_entries or not self._fresh(self._oldest_ts):
+                    evicted = self._evict(ts)
+                i = len(self._entries)
+                if i == len(self._matrix):
+                    self._matrix = np.resize(self._matrix, (2 * i, EMBED_DIM))
+                self._index[qhash] = i
+                self._entries.append((sql, result, ts))
+            else:
+                self._entries[i] = (sql, result, ts)
+            self._matrix[i] = vec
+        # Disk write outside _lock, so lookups on the event loop never wait on a commit
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO qa_cache (qhash, embedding, sql, result, ts) VALUES (?, ?, ?, ?, ?)",
+                (qhash, vec.tobytes(), sql, orjson.dumps(result, default=str), ts),
+            )
+            if evicted:
+                self._db.executemany("DELETE FROM qa_cache WHERE qhash = ?", [(h,) for h in evicted])
+            self._db.commit()
+
+
+semantic_cache = SemanticCache(CACHE_PATH, CACHE_TTL_HOURS, CACHE_MAX_ENTRIES)
+
+# 5️⃣ Schema retrieval — only send the tables a question is likely to need
+TOP_K_TABLES = 5
+TABLE_DESCRIPTIONS = {
+    "Album": "Music albums; each album belongs to one artist.",
+    "Artist": "Recording artists and bands.",
+    "Customer": "Store customers: name, company, address, country, email and support rep.",
+    "Employee": "Store staff: title, hire date, contact details and reporting hierarchy.",
+    "Genre": "Music genres such as Rock, Jazz or Metal.",
+    "Invoice": "Customer purchases: invoice date, billing address and country, total amount (sales, revenue).",
+    "InvoiceLine": "Invoice line items: which track was bought, unit price and quantity.",
+    "MediaType": "Audio file formats of tracks.",
+    "Playlist": "Named playlists.",
+    "PlaylistTrack": "Which tracks are on which playlist.",
+    "Track": "Songs: name, album, genre, media type, composer, duration, size and unit price.",
+}
+# Tables included whenever the question mentions one of these words
+ALWAYS_INCLUDE = {
+    "Invoice": ("sale", "revenue", "spend", "invoice", "purchase", "amount", "bought"),
+}
+
+_table_matrix: Optional[np.ndarray] = None
+_table_matrix_lock = asyncio.Lock()
+
+
+async def table_embeddings() -> np.ndarray:
+    """(len(ALL_TABLES), EMBED_DIM) matrix of table description + DDL embeddings, computed once."""
+    global _table_matrix
+    async with _table_matrix_lock:
+        if _table_matrix is None:
+            response = await client.embeddings.create(
+                model=EMBED_MODEL,
+                input=[f"{name}: {TABLE_DESCRIPTIONS.get(name, '')}\n{TABLE_DDL[name]}" for name in ALL_TABLES],
+            )
+            matrix = np.asarray([d.embedding for d in response.data], dtype=np.float32)
+            _table_matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    return _table_matrix
+
+
+async def select_tables(question: str, embedding: np.ndarray) -> Tuple[str, ...]:
+    """Top-k tables by cosine similarity to the question, plus keyword always-includes.
+    Returned sorted by name so each table set always builds the same prompt."""
+    sims = await table_embeddings() @ embedding
+    chosen = {ALL_TABLES[i] for i in np.argsort(-sims)[:TOP_K_TABLES]}
+    normalized = normalize_question(question)
+    chosen |= {t for t, words in ALWAYS_INCLUDE.items() if any(w in normalized for w in words)}
+    return tuple(sorted(chosen))
+
+
+# 6️⃣ SQL generation — single question, or several answered in one round-trip
+MAX_SQL_TOKENS = 256  # SQL is short; an explicit cap bounds generation latency
+BATCH_INSTRUCTIONS = (
+    "Answer each numbered question below independently. "
+    "Return one SQL string per question in the \"sql\" array, in the same order."
+)
+# Structured outputs: the model can only emit {"sql": "SELECT ..."} (or an array of them),
+# so there are no markdown fences or prose to strip and no parse-failure retries.
+_SELECT_SQL = {"type": "string", "pattern": "^SELECT"}
+SQL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sql_response",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"sql": _SELECT_SQL},
+            "required": ["sql"],
+            "additionalProperties": False,
+        },
+    },
+}
+SQL_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sql_batch_response",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"sql": {"type": "array", "items": _SELECT_SQL}},
+            "required": ["sql"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+async def generate_sql(question: str, tables: Tuple[str, ...] = ALL_TABLES) -> str:
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": build_system_prompt(tables)},
+            {"role": "user", "content": question}
+        ],
+        temperature=0,
+        max_tokens=MAX_SQL_TOKENS,
+        response_format=SQL_RESPONSE_FORMAT
+    )
+    sql_query = orjson.loads(response.choices[0].message.content)["sql"].strip()
+    print(f"🧠 GPT Generated SQL:\n{sql_query}\n")
+    return sql_query
+
+
+async def generate_sql_batch(questions: List[str], tables: Tuple[str, ...] = ALL_TABLES) -> List[str]:
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, start=1))
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": build_system_prompt(tables)},
+            {"role": "user", "content": f"{BATCH_INSTRUCTIONS}\n\n{numbered}"}
+        ],
+        temperature=0,
+        max_tokens=MAX_SQL_TOKENS * len(questions),
+        response_format=SQL_BATCH_RESPONSE_FORMAT
+    )
+    sql_queries = orjson.loads(response.choices[0].message.content)["sql"]
+    if len(sql_queries) != len(questions):
+        raise ValueError(f"Expected {len(questions)} SQL strings, got {len(sql_queries)}")
+    print(f"🧠 GPT Generated {len(sql_queries)} SQL queries in one batch")
+    return [q.strip() for q in sql_queries]
+
+
+# 7️⃣ Cap result size in SQL so the database, not the browser, does the reduction
+ROW_LIMIT = 5000
+# String literals, quoted identifiers and comments are matched whole, so a "(" or LIMIT
+# inside them is never mistaken for SQL
+_SQL_TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|[()]|\bLIMIT\b",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _strip_sql_tail(sql_query: str) -> str:
+    """Drop trailing whitespace, semicolons and comments ("... LIMIT 10; -- top ten")."""
+    while True:
+        sql_query = sql_query.strip().rstrip(";").rstrip()
+        last = None
+        for last in _SQL_TOKEN_RE.finditer(sql_query):
+            pass
+        if last is None or last.end() != len(sql_query) or not last.group().startswith(("--", "/*")):
+            return sql_query
+        sql_query = sql_query[:last.start()]
+
+
+def apply_row_limit(sql_query: str) -> str:
+    """Append ``LIMIT ROW_LIMIT`` unless the statement already has a LIMIT of any form
+    (``LIMIT 10``, ``LIMIT (10)``, ``LIMIT ? OFFSET ?``, ...). Only a LIMIT outside
+    parentheses counts — one in a subquery or CTE doesn't cap the outer result. It is
+    appended even to aggregate queries: a LIMIT is harmless on a one-row result, and
+    guessing "aggregate-only" from the text misfires on subqueries and window functions.
+    Appending, rather than wrapping in ``SELECT * FROM (...)``, keeps the query's own
+    ORDER BY authoritative."""
+    sql_query = _strip_sql_tail(sql_query)
+    depth = 0
+    for match in _SQL_TOKEN_RE.finditer(sql_query):
+        token = match.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token.upper() == "LIMIT":
+            return sql_query
+    return f"{sql_query}\nLIMIT {ROW_LIMIT}"
 
-        # Step 3: Execute query
-        with engine.connect() as conn:
-            result = conn.execute(text(sql_query))
-            rows = result.fetchall()
 
-        # Step 4: Return formatted results
-        if not rows:
-            return AskResponse(answer="No results found.")
+# Identical SQL (e.g. from two differently worded questions) reuses the serialized result
+RESULT_CACHE_SIZE = 512
+RESULT_CACHE_TTL_SECONDS = 600
+_result_cache: TTLCache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL_SECONDS)
+_result_cache_lock = threading.Lock()
 
-        formatted = [dict(row._mapping) for row in rows]
-        return AskResponse(answer=json.dumps(formatted, indent=2))
+
+def sql_cache_key(sql_query: str) -> str:
+    # Whitespace and a trailing ";" only — case is kept, since it matters inside string literals
+    return re.sub(r"\s+", " ", sql_query).strip().rstrip(";").rstrip()
+
+
+async def run_sql(sql_query: str) -> ResultPayload:
+    """Execute ``sql_query`` and return its rows column-split (``data`` is empty if none)."""
+    key = sql_cache_key(sql_query)
+    with _result_cache_lock:
+        answer = _result_cache.get(key)
+    if answer is not None:
+        print("⚡ SQL result cache hit")
+        return answer
+
+    async with engine.connect() as conn:
+        result = await conn.execute(text(sql_query))
+        columns = list(result.keys())
+        rows = [tuple(row) for row in result]
+
+    # Column-split: column names are sent once instead of per row, and the dashboard
+    # builds its DataFrame from it directly. orjson serializes the row tuples as-is when
+    # the event is written — no per-row dict or DataFrame in between.
+    answer = {"columns": columns, "data": rows}
+    with _result_cache_lock:
+        _result_cache[key] = answer
+    return answer
+
+
+SQLGenerator = Callable[[str, Tuple[str, ...]], Awaitable[str]]
+
+_cache_writes: Set[asyncio.Task] = set()  # keeps background writes referenced until done
+
+
+async def remember_answer(
+    question: str, qhash: str, embedding: Optional[np.ndarray], sql_query: str, answer: ResultPayload
+) -> None:
+    """Store an answered question in the semantic cache. Runs as a background task, off
+    the response path: a failure (e.g. "database is locked" with several workers sharing
+    the sidecar file) is logged and never reaches the caller, who already has the rows."""
+    try:
+        if embedding is None:
+            embedding = await embed(question)
+        await asyncio.to_thread(semantic_cache.put, qhash, embedding, sql_query, answer)
+    except Exception as e:
+        print(f"⚠️ Semantic cache write failed: {e}")
+
+
+# 8️⃣ Function to handle user query
+async def ask_database_events(
+    question: str, sql_generator: SQLGenerator = generate_sql
+) -> AsyncIterator[dict]:
+    """Answer ``question`` as a sequence of events, so callers can show the SQL before
+    the rows arrive:
+
+    - ``{"stage": "sql", "sql": ...}`` as soon as the SQL is known
+    - ``{"stage": "rows", "columns": [...], "data": [[...], ...]}`` with the result rows
+    - ``{"stage": "error", "answer": ...}`` instead of ``rows`` if anything fails
+
+    ``sql_generator(question, tables)`` lets callers route the LLM call elsewhere, e.g.
+    through the request batcher in main.py.
+    """
+    try:
+        # Step 0: Check the semantic cache (exact match first, then nearest neighbour)
+        qhash = question_hash(question)
+        embedding = None
+        hit = semantic_cache.get(qhash)
+        if hit is None:
+            embedding = await embed(question)
+            hit = semantic_cache.nearest(embedding)
+
+        if hit and hit.similarity > RESULT_REUSE_THRESHOLD and hit.result is not None:
+            print(f"⚡ Cache hit (sim={hit.similarity:.3f}), reusing result")
+            yield {"stage": "sql", "sql": hit.sql}
+            yield {"stage": "rows", **hit.result}
+            return
+
+        if hit and hit.similarity > SQL_REUSE_THRESHOLD:
+            print(f"⚡ Cache hit (sim={hit.similarity:.3f}), reusing SQL")
+            sql_query = hit.sql
+        else:
+            # Step 1: Let GPT-4o-mini generate SQL from the relevant part of the schema
+            tables = await select_tables(question, embedding) if embedding is not None else ALL_TABLES
+            sql_query = await sql_generator(question, tables)
+
+        # Step 2: Safety check — only SELECT queries allowed (the response schema already
+        # enforces this for generated SQL; kept as defense-in-depth)
+        if not sql_query.upper().startswith("SELECT"):
+            yield {"stage": "error", "answer": "❌ Only SELECT queries are allowed."}
+            return
+        sql_query = apply_row_limit(sql_query)
+        yield {"stage": "sql", "sql": sql_query}
+
+        # Step 3: Execute query (or reuse the result of identical SQL)
+        answer = await run_sql(sql_query)
+
+        # Step 4: Remember this question for next time. Scheduled before the rows go out,
+        # so a client that disconnects right after them still gets it cached.
+        task = asyncio.create_task(remember_answer(question, qhash, embedding, sql_query, answer))
+        _cache_writes.add(task)
+        task.add_done_callback(_cache_writes.discard)
+        yield {"stage": "rows", **answer}
 
     except SQLAlchemyError as e:
         print(f"❌ SQLAlchemy error: {e}")
-        return AskResponse(answer=f"Database error: {str(e)}")
+        yield {"stage": "error", "answer": f"Database error: {str(e)}"}
     except Exception as e:
         print(f"❌ General error: {e}")
-        return AskResponse(answer=f"Error: {str(e)}")
+        yield {"stage": "error", "answer": f"Error: {str(e)}"}
+
+
+async def ask_database(
+    question: str, sql_generator: SQLGenerator = generate_sql
+) -> AskResponse:
+    """Non-streaming wrapper around :func:`ask_database_events`; the rows come back as a
+    column-split JSON string in ``answer`` (or "No results found.")."""
+    response = AskResponse(answer="")
+    async for update in ask_database_events(question, sql_generator):
+        if update["stage"] == "sql":
+            response.sql = update["sql"]
+        elif update["stage"] == "rows":
+            response.answer = "No results found." if not update["data"] else orjson.dumps(
+                {"columns": update["columns"], "data": update["data"]}, default=str
+            ).decode()
+        else:
+            response.answer = update["answer"]
+    return response
@@ -1,7 +1,10 @@
 # dashboard.py — AI SQL Analytics Dashboard (modern, clean, English-only)
 
-import json
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import requests
 import pandas as pd
 import plotly.express as px
@@ -20,8 +23,10 @@ API_URL = st.secrets.get("API_URL", "http://127.0.0.1:8000/ask")  # fallback for
 # ---------- Page Setup ----------
 st.set_page_config(page_title="AI SQL Analytics", page_icon="📊", layout="wide", initial_sidebar_state="collapsed")
 
-# Custom minimal styling
-st.markdown("""
+# Custom minimal styling — cached, so reruns replay the element instead of rebuilding it
+@st.cache_resource
+def _inject_css():
+    st.markdown("""
 <style>
 :root { --bg: #0e1117; --panel:#161a23; --text:#e6e6e6; --muted:#9aa0a6; }
 html, body, [class*="css"]  { background-color: var(--bg) !important; color: var(--text) !important; }
@@ -34,46 +39,58 @@ hr { border: 1px solid #232a3a; }
 </style>
 """, unsafe_allow_html=True)
 
+_inject_css()
+
 # ---------- Sidebar (history, examples) ----------
 st.sidebar.title("🧠 Query History")
 if "history" not in st.session_state:
     st.session_state.history = []  # list of dicts: {q, sql, rows}
 
-with st.sidebar:
+EXAMPLES = [
+    "Top 5 artists by number of albums (bar chart)",
+    "Total invoice amount by country (pie chart)",
+    "Monthly sales trend for 2010-2013 (line chart)",
+    "Tracks per genre (bar chart)",
+    "Top customers by total spend (bar chart)"
+]
+
+def _use_example():
+    st.session_state["prefill"] = st.session_state["example_pick"]
+    st.session_state["example_picked"] = True
+
+@st.fragment
+def render_sidebar():
+    """Own fragment, so expanding history or picking an example doesn't rerun the chart."""
     if st.session_state.history:
         for i, h in enumerate(reversed(st.session_state.history[-10:]), start=1):
             with st.expander(f"{i}. {h['q'][:50]}"):
                 st.code(h.get("sql") or "--", language="sql")
                 st.text(f"Rows: {h.get('rows', 0)}")
     st.markdown("---")
-    st.caption("💡 Examples")
-    examples = [
-        "Top 5 artists by number of albums (bar chart)",
-        "Total invoice amount by country (pie chart)",
-        "Monthly sales trend for 2010-2013 (line chart)",
-        "Tracks per genre (bar chart)",
-        "Top customers by total spend (bar chart)"
-    ]
-    for ex in examples:
-        if st.button(ex, key=f"ex_{ex}"):
-
-            st.session_state["prefill"] = ex
+    # One selectbox instead of a button per example: a single widget to register per rerun
+    st.selectbox(
+        "💡 Examples",
+        EXAMPLES,
+        index=None,
+        placeholder="Pick an example question",
+        key="example_pick",
+        on_change=_use_example
+    )
+    if st.session_state.pop("example_picked", False):
+        st.rerun()  # full rerun so the question box picks up the example
+
+with st.sidebar:
+    render_sidebar()
 
 # ---------- Header ----------
-left, right = st.columns([0.75, 0.25])
-with left:
-    st.title("📊 AI SQL Analytics Dashboard")
-    st.caption("Ask in plain English. Add chart hints like ‘bar chart’ or ‘line chart’.")
-with right:
-    chart_pref = st.selectbox(
-        "Chart preference (optional)",
-        ["Auto", "Bar", "Line", "Pie", "Area", "Table"],
-        index=0
-    )
+st.title("📊 AI SQL Analytics Dashboard")
+st.caption("Ask in plain English. Add chart hints like ‘bar chart’ or ‘line chart’.")
 
 # ---------- Input ----------
-default_q = st.session_state.pop("prefill", "Top 5 artists by number of albums (bar chart)")
-query = st.text_input("💬 Your question", value=default_q, key="nlq")
+if "prefill" in st.session_state:
+    st.session_state["nlq"] = st.session_state.pop("prefill")
+st.session_state.setdefault("nlq", "Top 5 artists by number of albums (bar chart)")
+query = st.text_input("💬 Your question", key="nlq")
 
 go = st.button("Run Query")
 
@@ -88,83 +105,272 @@ def infer_chart_type(q: str, override: str) -> str:
     if "area" in ql: return "area"
     return "table"
 
+ANSWER_TTL_SECONDS = 300
+ANSWER_CACHE_MAX = 20  # per session; each answer holds up to 5000 rows
+
+def stream_answer(q: str, cancel: threading.Event = None):
+    """Yield ``(text, event)`` for each of the backend's server-sent events as it arrives:
+    the JSON text and its parsed form (``{"stage": "sql" | "rows" | "error", ...}``).
+    Stops, closing the connection, at the first line read after ``cancel`` is set."""
+    with requests.post(API_URL, json={"query": q}, stream=True, timeout=60) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(decode_unicode=True):
+            if cancel is not None and cancel.is_set():
+                resp.close()
+                return
+            if line and line.startswith("data: "):
+                text = line[len("data: "):]
+                yield text, orjson.loads(text)
+
+def fetch_answer(q: str, sql_events: queue.Queue, cancel: threading.Event) -> dict:
+    """Run in a background thread: collect the streamed answer, forwarding the SQL as soon
+    as it arrives. Must not call any ``st.*`` API (there is no script context here)."""
+    result = {"q": q, "sql": None, "raw": None, "payload": None, "error": None}
+    for text, event in stream_answer(q, cancel):
+        if event["stage"] == "sql":
+            result["sql"] = event["sql"]
+            sql_events.put(event["sql"])
+        elif event["stage"] == "rows":
+            # The event text keys the caches below; the parsed event feeds build_df as-is
+            result["raw"], result["payload"] = text, event
+        else:
+            result["error"] = event["answer"]
+    return result
+
+def session_answers() -> dict:
+    """This session's answers by question, oldest first, with expired ones removed."""
+    answers = st.session_state.setdefault("answers", {})
+    now = time.time()
+    for q in [q for q, entry in answers.items() if now - entry["ts"] >= ANSWER_TTL_SECONDS]:
+        del answers[q]
+    return answers
+
+def cached_answer(q: str):
+    """Repeat questions within ANSWER_TTL_SECONDS reuse this session's earlier answer."""
+    return session_answers().get(q)
+
+def store_answer(q: str, result: dict):
+    """Remember ``result`` for ``q``, keeping at most ANSWER_CACHE_MAX answers."""
+    answers = session_answers()
+    answers.pop(q, None)  # re-inserted at the end, so dict order stays oldest first
+    result["ts"] = time.time()
+    answers[q] = result
+    while len(answers) > ANSWER_CACHE_MAX:
+        del answers[next(iter(answers))]
+
+@st.cache_data(show_spinner=False)
+def build_df(raw: str, _payload: dict = None) -> pd.DataFrame:
+    """DataFrame for the backend's column-split ``rows`` event. Cached on ``raw``, its JSON
+    text; ``_payload`` is that text already parsed, so a fresh answer isn't parsed twice."""
+    try:
+        data = _payload if _payload is not None else orjson.loads(raw)
+    except Exception:
+        data = []
+    if isinstance(data, dict) and "columns" in data:
+        return pd.DataFrame(data["data"], columns=data["columns"])
+    return pd.DataFrame(data)
+
+def result_frame(raw: str, payload: dict = None) -> pd.DataFrame:
+    """DataFrame for ``raw``, kept in session state while the payload is unchanged.
+
+    Reruns with the same result (repeat Run Query, widget changes) skip build_df's cache
+    lookup, which re-hashes the payload and unpickles a fresh copy of the frame.
+    """
+    payload_hash = hash(raw)  # str hashes are memoised on the object
+    if st.session_state.get("last_payload_hash") != payload_hash:
+        st.session_state["last_payload_hash"] = payload_hash
+        st.session_state["last_df"] = build_df(raw, payload)
+        st.session_state["last_fig_key"] = None
+        st.session_state["last_csv"] = None
+    return st.session_state["last_df"]
+
+@st.cache_data(show_spinner=False)
+def classify_cols(_df: pd.DataFrame, dtypes_key: tuple):
+    """Split columns into (categorical, numeric) lists. Cached on ``dtypes_key`` — the
+    (column, dtype) pairs — since ``_df`` itself is excluded from hashing."""
+    num_cols = _df.select_dtypes(include="number").columns.tolist()
+    numeric = set(num_cols)
+    return [c for c in _df.columns if c not in numeric], num_cols
+
+# Rendering limits: SVG Plotly traces stall the browser well before WebGL ones do
+DOWNSAMPLE_THRESHOLD = 1000  # bar/pie results beyond this are cut to the top N rows
+DOWNSAMPLE_TOPN = 50
+PIE_MAX_SLICES = 100
+TEXT_LABEL_MAX_ROWS = 200  # per-bar text labels dominate SVG cost on large charts
+
+def top_rows(df: pd.DataFrame, n: int, y_col: str) -> pd.DataFrame:
+    """Largest ``n`` rows by ``y_col``; just the first ``n`` when ``y_col`` isn't numeric."""
+    if pd.api.types.is_numeric_dtype(df[y_col]):
+        return df.nlargest(n, y_col)
+    return df.head(n)
+
+@st.cache_data(show_spinner=False)
+def build_fig(df_json: str, ctype: str, x_col: str, y_col: str, show_all: bool = False):
+    """Keyed on the raw JSON payload (DataFrames aren't cheaply hashable).
+
+    Returns ``(figure dict or None, caption or None, warning or None)``.
+    """
+    df = build_df(df_json)
+    fig, caption, warning = None, None, None
+    if ctype in ("bar", "pie") and len(df) > DOWNSAMPLE_THRESHOLD and not show_all:
+        basis = f"top by {y_col}" if pd.api.types.is_numeric_dtype(df[y_col]) else "first rows"
+        caption = f"Chart downsampled to {DOWNSAMPLE_TOPN} of {len(df)} rows ({basis})."
+        df = top_rows(df, DOWNSAMPLE_TOPN, y_col)
+    if ctype == "bar":
+        fig = px.bar(df, x=x_col, y=y_col, text=y_col if len(df) <= TEXT_LABEL_MAX_ROWS else None)
+    elif ctype == "line":
+        fig = px.line(df, x=x_col, y=y_col, markers=True, render_mode="webgl")
+    elif ctype == "pie":
+        if len(df) > PIE_MAX_SLICES:
+            warning = f"Pie charts are limited to {PIE_MAX_SLICES} slices; showing the largest {PIE_MAX_SLICES} of {len(df)}."
+            df = top_rows(df, PIE_MAX_SLICES, y_col)
+        fig = px.pie(df, names=x_col, values=y_col, hole=0.3)
+    elif ctype == "area":
+        # px.area has no WebGL mode; a filled scattergl line renders the same chart
+        fig = px.line(df, x=x_col, y=y_col, render_mode="webgl")
+        fig.update_traces(fill="tozeroy")
+    if fig is None:
+        return None, caption, warning
+    fig.update_layout(template="plotly_dark", height=520, margin=dict(l=10, r=10, t=40, b=10))
+    return fig.to_dict(), caption, warning
+
+@st.fragment
+def render_chart(raw: str, q: str, x_col: str, y_col: str):
+    """Changing the chart preference reruns only this fragment, not the query path."""
+    title, pref = st.columns([0.75, 0.25])
+    with title:
+        st.subheader("Visualization")
+    with pref:
+        chart_pref = st.selectbox(
+            "Chart preference (optional)",
+            ["Auto", "Bar", "Line", "Pie", "Area", "Table"],
+            index=0,
+            key="chart_pref"
+        )
+    ctype = infer_chart_type(q, chart_pref)
+    if y_col is None:
+        return
+    show_all = False
+    if ctype == "bar" and len(result_frame(raw)) > DOWNSAMPLE_THRESHOLD:
+        show_all = st.toggle("Show all bars", value=False, key="show_all_bars")
+    fig_key = (hash(raw), ctype, x_col, y_col, show_all)
+    if st.session_state.get("last_fig_key") != fig_key:
+        st.session_state["last_fig"] = build_fig(raw, ctype, x_col, y_col, show_all)
+        st.session_state["last_fig_key"] = fig_key
+    fig, caption, warning = st.session_state["last_fig"]
+    if warning:
+        st.warning(warning)
+    if caption:
+        st.caption(caption)
+    if fig:
+        st.plotly_chart(fig, width='stretch')
+
 # ---------- Action ----------
+# The request runs on a per-session background thread and is polled here, so a rerun
+# (chart change) interrupts only the polling loop, not the request itself. Dropping a
+# request (Cancel, or a new Run Query) sets its cancel event; the thread then closes the
+# connection at the next streamed line. Spare workers keep a request still waiting on
+# that line from delaying the next one.
+if "executor" not in st.session_state:
+    st.session_state.executor = ThreadPoolExecutor(max_workers=4)
+
+def drop_pending():
+    dropped = st.session_state.pop("pending", None)
+    if dropped is not None:
+        dropped["cancel"].set()
+
 if go and query.strip():
-    placeholder = st.empty()
-    with placeholder.container():
-        with st.spinner("🧠 Thinking & fetching data... please wait"):
-            try:
-                resp = requests.post(API_URL, json={"query": query}, timeout=60)
-
-                if resp.status_code != 200:
-                    st.error(f"Server error: {resp.status_code}")
-                else:
-                    payload = resp.json()
-                    raw = payload.get("answer", "[]")
-                    sql = payload.get("sql", None)
-
-                    # Show SQL
-                    with st.expander("Generated SQL", expanded=False):
-                        st.code(sql or "--", language="sql")
-
-                    # Parse rows
-                    try:
-                        data = json.loads(raw) if isinstance(raw, str) else raw
-                    except Exception:
-                        data = []
-                    df = pd.DataFrame(data)
-
-                    if df.empty:
-                        st.warning("No results found.")
-                    else:
-                        # ---- Draw Chart (Top) ----
-                        ctype = infer_chart_type(query, chart_pref)
-                        st.subheader("Visualization")
-
-                        x_col, y_col = None, None
-                        if len(df.columns) >= 2:
-                            cat_candidates = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]
-                            num_candidates = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
-                            x_col = cat_candidates[0] if cat_candidates else df.columns[0]
-                            y_col = num_candidates[0] if num_candidates else (df.columns[1] if len(df.columns) > 1 else None)
-
-                        fig = None
-                        if y_col is not None:
-                            if ctype == "bar":
-                                fig = px.bar(df, x=x_col, y=y_col, text=y_col)
-                            elif ctype == "line":
-                                fig = px.line(df, x=x_col, y=y_col, markers=True)
-                            elif ctype == "pie":
-                                fig = px.pie(df, names=x_col, values=y_col, hole=0.3)
-                            elif ctype == "area":
-                                fig = px.area(df, x=x_col, y=y_col)
-
-                        if fig:
-                            fig.update_layout(template="plotly_dark", height=520, margin=dict(l=10, r=10, t=40, b=10))
-                            st.plotly_chart(fig, width='stretch')
-
-                        # ---- Table (Below) ----
-                        st.markdown("---")
-                        st.subheader("Data Table")
-                        st.dataframe(df, width='stretch')
-
-                        # ---- Download ----
-                        st.markdown("### ⬇️ Download Results")
-                        st.download_button("Download CSV", data=df.to_csv(index=False), file_name="result.csv", mime="text/csv")
-
-                        # Save to history
-                        st.session_state.history.append({
-                            "q": query, "sql": sql, "rows": len(df)
-                        })
-
-                        st.success("✅ Query completed successfully!")
-
-            except requests.exceptions.ConnectionError:
-                st.error("⚠️ Backend not running on port 8000. Please start FastAPI with `uvicorn main:app --reload`.")
-            except requests.exceptions.Timeout:
-                st.error("⚠️ Request timed out. Try a simpler question or check the server.")
-            except Exception as e:
-                st.error(f"Unexpected error: {e}")
+    st.session_state.pop("result", None)
+    drop_pending()
+    result = cached_answer(query)
+    if result is None:
+        sql_events, cancel = queue.Queue(), threading.Event()
+        st.session_state["pending"] = {
+            "q": query, "sql": None, "sql_events": sql_events, "cancel": cancel, "started": time.time(),
+            "future": st.session_state.executor.submit(fetch_answer, query, sql_events, cancel),
+        }
+    else:
+        st.session_state["result"] = result
+
+pending = st.session_state.get("pending")
+if pending is not None:
+    if st.button("Cancel"):
+        drop_pending()
+        st.rerun()
+    status = st.empty()
+    sql_preview = st.empty()
+    while not pending["future"].done():
+        while not pending["sql_events"].empty():
+            pending["sql"] = pending["sql_events"].get()
+        if pending["sql"]:
+            # Show the SQL while the rows are still being fetched
+            sql_preview.code(pending["sql"], language="sql")
+        status.info(f"🧠 Thinking & fetching data... {time.time() - pending['started']:.1f}s")
+        time.sleep(0.2)
+    status.empty()
+    sql_preview.empty()
+    st.session_state.pop("pending", None)
+
+    try:
+        result = pending["future"].result()
+        if result["error"] is not None:
+            st.error(result["error"])
+        else:
+            store_answer(pending["q"], result)
+            st.session_state["result"] = result
+            df = result_frame(result["raw"], result.pop("payload"))
+            if not df.empty:
+                # Save to history
+                st.session_state.history.append({
+                    "q": pending["q"], "sql": result["sql"], "rows": len(df)
+                })
+    except requests.exceptions.HTTPError as e:
+        st.error(f"Server error: {e.response.status_code}")
+    except requests.exceptions.ConnectionError:
+        st.error("⚠️ Backend not running on port 8000. Please start FastAPI with `uvicorn main:app --reload`.")
+    except requests.exceptions.Timeout:
+        st.error("⚠️ Request timed out. Try a simpler question or check the server.")
+    except Exception as e:
+        st.error(f"Unexpected error: {e}")
+
+# ---------- Results ----------
+# Kept in session state so fragment reruns (chart preference) can redraw them.
+if "result" in st.session_state:
+    result = st.session_state["result"]
+    raw, sql = result["raw"], result["sql"]
+
+    # Show SQL
+    with st.expander("Generated SQL", expanded=False):
+        st.code(sql or "--", language="sql")
+
+    # Parse rows (reused while the payload is unchanged)
+    df = result_frame(raw)
+
+    if df.empty:
+        st.warning("No results found.")
+    else:
+        # ---- Draw Chart (Top) ----
+        x_col, y_col = None, None
+        if len(df.columns) >= 2:
+            cat_candidates, num_candidates = classify_cols(df, tuple(zip(df.columns, df.dtypes.astype(str))))
+            x_col = cat_candidates[0] if cat_candidates else df.columns[0]
+            y_col = num_candidates[0] if num_candidates else (df.columns[1] if len(df.columns) > 1 else None)
+
+        render_chart(raw, result["q"], x_col, y_col)
+
+        # ---- Table (Below) ----
+        st.markdown("---")
+        st.subheader("Data Table")
+        st.dataframe(df, width='stretch')
+
+        # ---- Download ----
+        st.markdown("### ⬇️ Download Results")
+        if st.session_state.get("last_csv") is None:
+            st.session_state["last_csv"] = df.to_csv(index=False)
+        st.download_button("Download CSV", data=st.session_state["last_csv"], file_name="result.csv", mime="text/csv")
+
+        if go:
+            st.success("✅ Query completed successfully!")
 
     # Footer
     st.markdown("---")
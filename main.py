@@ -1,15 +1,97 @@
 # main.py
 
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Set, Tuple
+
+import orjson
 from fastapi import FastAPI
-from ask import ask_database
-from schemas import AskRequest, AskResponse
+from fastapi.responses import StreamingResponse
+from ask import ask_database_events, generate_sql, generate_sql_batch, http_client, table_embeddings
+from schemas import AskRequest
+
+BATCH_WINDOW_SECONDS = 0.15
+BATCH_MAX_SIZE = 8
+
+
+class SQLBatcher:
+    """Micro-batches concurrent NL→SQL requests into a single OpenAI call.
+
+    When nothing is in flight, a lone request is dispatched straight away through the
+    single-question path so low traffic never pays the batching window. While an OpenAI
+    call is already running (or others are queued), the worker instead collects up to
+    ``max_size`` questions or ``window`` seconds' worth, so staggered arrivals share a call.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW_SECONDS, max_size: int = BATCH_MAX_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self.queue: "asyncio.Queue[Tuple[str, Tuple[str, ...], asyncio.Future]]" = asyncio.Queue()
+        self._inflight: Set[asyncio.Task] = set()  # also keeps dispatch tasks referenced
+
+    async def generate(self, question: str, tables: Tuple[str, ...]) -> str:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((question, tables, future))
+        return await future
 
-app = FastAPI()
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self._inflight or not self.queue.empty():
+                deadline = loop.time() + self.window
+                while len(batch) < self.max_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, Tuple[str, ...], asyncio.Future]]):
+        questions = [q for q, _, _ in batch]
+        # One prompt for the whole batch: the union of each question's tables
+        tables = tuple(sorted({t for _, ts, _ in batch for t in ts}))
+        try:
+            if len(questions) == 1:
+                results = [await generate_sql(questions[0], tables)]
+            else:
+                results = await generate_sql_batch(questions, tables)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), sql_query in zip(batch, results):
+            if not future.done():
+                future.set_result(sql_query)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await table_embeddings()  # warm the schema-retrieval index before the first request
+    app.state.batcher = SQLBatcher()
+    worker = asyncio.create_task(app.state.batcher.run())
+    yield
+    worker.cancel()
+    await http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def root():
     return {"message": "AI SQL Agent running"}
 
-@app.post("/ask", response_model=AskResponse)
-def ask(request: AskRequest):
-    return ask_database(request.query)
+@app.post("/ask")
+async def ask(request: AskRequest):
+    """Server-sent events: the generated SQL first, then the rows (see ask_database_events)."""
+    async def event_stream():
+        async for event in ask_database_events(request.query, app.state.batcher.generate):
+            yield b"data: " + orjson.dumps(event, default=str) + b"\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
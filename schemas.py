@@ -1,5 +1,7 @@
 # schemas.py
 
+from typing import Optional
+
 from pydantic import BaseModel
 
 class AskRequest(BaseModel):
@@ -7,3 +9,4 @@ class AskRequest(BaseModel):
 
 class AskResponse(BaseModel):
     answer: str
+    sql: Optional[str] = None